@@ -2,12 +2,12 @@
 Streamlit Web App per generazione etichette DYMO.
 App dashboard per Bamboom - Carica Excel, Genera etichette, Scarica ZIP.
 
-SELECTION ARCHITECTURE (Barcode-based tracking):
-- selection_override: Dict[Barcode: bool] - Maps product Barcode to selection state
-- Uses stable unique Barcode instead of Pandas row index or non-unique Code
-- Survives data reordering, row insertions/deletions
-- Redundant overrides (matching group baseline) are automatically pruned
-- Stale overrides (Barcodes no longer in dataset) are automatically purged
+SELECTION ARCHITECTURE (row mask):
+- selection_mask: numpy bool array aligned with the rows of the uploaded file,
+  the single source of truth for which products get a label
+- Adding/removing a group sets/clears that group's rows
+- Bulk buttons set/clear the visible rows; editor submits write only the changed rows
+- The last action on a row wins, so no override bookkeeping or pruning is needed
 - File upload change detection resets all selection state
 
 REQUIRED FILE FORMAT:
@@ -15,22 +15,32 @@ REQUIRED FILE FORMAT:
 - Barcode must be unique per product (validated on upload)
 """
 
+import hashlib
 import io
+import os
+import tempfile
+import time
 from pathlib import Path
+import numpy as np
 import streamlit as st
 import pandas as pd
 
 from utils import (
     read_template,
-    read_excel_data,
+    read_data_frame,
     merge_product_ean_data,
-    validate_data,
-    generate_labels,
+    validate_columns,
+    iter_labels,
     create_zip_archive
 )
 
+# Copy-on-Write: derived frames (filter, assign) share data until mutated.
+# Always on from pandas 3.0, must be enabled explicitly on 2.x
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
-def transform_for_template(rows):
+
+def transform_for_template(df):
     """
     Transform client's real column names to template placeholders.
 
@@ -42,25 +52,156 @@ def transform_for_template(rows):
     - Barcode → Barcode (unchanged)
 
     Args:
-        rows: List of dicts with real column names
+        df: DataFrame with real column names
+
+    Returns:
+        DataFrame with the template placeholder columns (Code, Desc, Color, Size, Barcode) added
+    """
+    return df.assign(
+        Code=df.get('Articolo', ''),
+        Desc=df.get('Descrizione Articolo', ''),
+        Color=df.get('Colore', ''),
+        Size=df.get('Taglia', ''),
+        Barcode=df.get('Barcode', ''),
+    )
+
+
+# Parsed uploads kept in the shared cache (least recently used evicted first)
+UPLOAD_CACHE_ENTRIES = 4
+
+
+def _upload_digest(uploaded_file) -> str:
+    """
+    Content hash of an uploaded file, used as cache key for its parsed data.
+
+    Hashes the upload buffer in place (no copy of the bytes), which is much
+    cheaper than letting st.cache_data pickle and hash the raw content. The
+    digest is remembered in session state per upload (file_id), so reruns
+    with the same upload do not hash the bytes again.
+    """
+    upload_id = getattr(uploaded_file, "file_id", None)
+    cached = st.session_state.get('upload_digest')
+    if upload_id is not None and cached is not None and cached[0] == upload_id:
+        return cached[1]
+
+    digest = hashlib.blake2b(uploaded_file.getbuffer(), digest_size=16).hexdigest()
+    if upload_id is not None:
+        st.session_state['upload_digest'] = (upload_id, digest)
+    return digest
+
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_ENTRIES)
+def _load_df(file_digest: str, ext: str, _file_obj: io.BytesIO):
+    """
+    Parse an uploaded Excel/CSV file once per distinct content.
+
+    The cache is keyed on the content digest (see _upload_digest); the
+    underscore-prefixed file object is not hashed by Streamlit and is parsed
+    in place, without copying the upload into a new buffer.
+
+    The low-cardinality columns (CATEGORY_COLUMNS) are stored as category,
+    so each distinct colour/size/group is kept once and rows hold int codes.
+
+    Args:
+        file_digest: Content digest of the uploaded file
+        ext: Lowercase file extension (".xlsx", ".xls" or ".csv")
+        _file_obj: The uploaded file (any BytesIO)
+
+    Returns:
+        DataFrame as returned by read_data_frame, with CATEGORY_COLUMNS as category
+    """
+    _file_obj.seek(0)
+    df = read_data_frame(
+        _file_obj, sheet=None, sep=",", encoding="utf-8", suffix=ext, columns=DATA_COLUMNS
+    )
+    return df.astype({col: "category" for col in CATEGORY_COLUMNS if col in df.columns})
+
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_ENTRIES)
+def _load_file_index(file_digest: str, ext: str, _file_obj: io.BytesIO):
+    """
+    Derive the lookup structures used by the selection UI, once per distinct upload.
+
+    Keyed on the same content digest as _load_df, so a new session uploading the
+    same file reuses them instead of regrouping the catalogue. main() keeps
+    the result in session_state, so reruns do not even pay the cache lookup.
+
+    Args:
+        file_digest: Content digest of the uploaded file
+        ext: Lowercase file extension (".xlsx", ".xls" or ".csv")
+        _file_obj: The uploaded file (any BytesIO)
+
+    Returns:
+        Dict with:
+            - group_rows: 'Codice Gruppo' value -> numpy array of row positions
+            - group_counts: 'Codice Gruppo' value -> product count
+            - sorted_groups: groups by product count (descending), alphabetical on ties
+            - search_lc: lowercase "Articolo\nDescrizione Articolo" per row for the search
+    """
+    df = _load_df(file_digest, ext, _file_obj)
+    if 'Codice Gruppo' in df.columns:
+        group_rows = df.groupby('Codice Gruppo', sort=False, observed=True).indices
+        group_counts = df['Codice Gruppo'].value_counts().to_dict()
+    else:
+        group_rows = {}
+        group_counts = {}
+    return {
+        'group_rows': group_rows,
+        'group_counts': group_counts,
+        'sorted_groups': sorted(sorted(group_counts), key=group_counts.get, reverse=True),
+        'search_lc': _search_column(df),
+    }
+
+
+def _search_column(df):
+    """
+    Build the lowercase text the product search scans, one entry per row.
+
+    Search terms come from a single-line input and never contain "\n",
+    so one substring scan over the joined text matches either column.
+    A column missing from the file contributes an empty string.
+
+    Args:
+        df: Product DataFrame as returned by _load_df
+
+    Returns:
+        Series of lowercase "Articolo\nDescrizione Articolo" strings
+    """
+    text = df.reindex(columns=SEARCH_COLUMNS, fill_value="")
+    return (text[SEARCH_COLUMNS[0]] + "\n" + text[SEARCH_COLUMNS[1]]).str.lower()
+
+
+@st.cache_data(show_spinner=False)
+def _load_template(template_path: str, mtime_ns):
+    """
+    Read the DYMO template once per version of the file on disk.
+
+    Args:
+        template_path: Path of the .dymo template
+        mtime_ns: Modification time of the template (cache key only; None if missing)
 
     Returns:
-        List of dicts with template placeholder names (Code, Desc, Color, Size, Barcode)
+        Template XML content
     """
-    transformed = []
-    for row in rows:
-        new_row = row.copy()
+    return read_template(template_path)
 
-        # Map column names
-        new_row['Code'] = row.get('Articolo', '')
-        new_row['Desc'] = row.get('Descrizione Articolo', '')
-        new_row['Color'] = row.get('Colore', '')
-        new_row['Size'] = row.get('Taglia', '')
-        new_row['Barcode'] = row.get('Barcode', '')
 
-        transformed.append(new_row)
+@st.cache_data(show_spinner=False)
+def _validate_columns(template_xml: str, columns: tuple):
+    """
+    Validate the template placeholders against a set of column names.
+
+    Validation only looks at column names, so the result is cached per
+    column set and stays valid while the selection changes.
 
-    return transformed
+    Args:
+        template_xml: Template XML content
+        columns: Column names of the transformed data
+
+    Returns:
+        Validation dict as returned by validate_columns
+    """
+    return validate_columns(template_xml, columns)
 
 
 # Configurazione pagina
@@ -72,7 +213,7 @@ st.set_page_config(
 )
 
 # Custom CSS per brand BAMBOOM
-st.markdown("""
+_CSS = """
 <style>
     /* Brand colors e styling */
     .stButton>button {
@@ -128,274 +269,136 @@ st.markdown("""
         padding: 0.5rem 1rem;
         margin-bottom: 1rem;
     }
-
-    /* Group checkbox grid */
-    .group-checkbox-container {
-        display: grid;
-        grid-template-columns: repeat(5, 1fr);
-        gap: 0.5rem;
-        margin: 1rem 0;
-    }
-
-    .group-checkbox-item {
-        padding: 0.4rem 0.6rem;
-        border: 1px solid #E6E4E0;
-        border-radius: 6px;
-        font-size: 0.9rem;
-    }
-
-    .group-checkbox-item:hover {
-        background-color: rgba(142, 163, 149, 0.05);
-    }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(_CSS, unsafe_allow_html=True)
 
 # Template path (hardcoded come richiesto)
 TEMPLATE_PATH = Path("template_bamboom.dymo")
 DEFAULT_FILENAME_PATTERN = "{Code}_{Color}_{Size}.dymo"
-
-
-def main():
-    # Header con Logo
-    col1, col2, col3 = st.columns([1, 2, 1])
-    with col2:
+# Colonne lette dal file caricato: le altre vengono saltate dal parser
+DATA_COLUMNS = ["Articolo", "Descrizione Articolo", "Colore", "Taglia", "Codice Gruppo", "Barcode"]
+# Colonne su cui cerca la ricerca prodotti
+SEARCH_COLUMNS = ["Articolo", "Descrizione Articolo"]
+# Colonne con pochi valori distinti, memorizzate come category
+CATEGORY_COLUMNS = ["Colore", "Taglia", "Codice Gruppo"]
+# Righe mostrate per pagina nell'editor prodotti
+PRODUCT_PAGE_SIZE = 100
+# Prefisso e durata massima degli ZIP temporanei generati
+ZIP_PREFIX = "etichette_dymo_"
+ZIP_MAX_AGE_SECONDS = 60 * 60
+
+
+def _remove_zip_file(path):
+    """Delete a previously generated temporary ZIP, ignoring missing files."""
+    if path:
         try:
-            st.image("logo.png", width=300)
-        except:
-            st.title("BAMBOOM")
-
-    st.markdown("<h2 style='text-align: center;'>Generatore Etichette DYMO</h2>", unsafe_allow_html=True)
-    st.markdown("<p style='text-align: center; color: #8E8E8E;'>Carica il tuo file Excel e genera le etichette DYMO</p>", unsafe_allow_html=True)
-    st.divider()
-
-    # Verifica che il template esista
-    if not TEMPLATE_PATH.exists():
-        st.error(f"Template non trovato: {TEMPLATE_PATH}")
-        st.info("Assicurati che il file `template_bamboom.dymo` sia presente nella cartella del progetto.")
-        st.stop()
-
-    # Sezione 1: Upload file
-    st.header("1. Carica File Excel")
-    uploaded_file = st.file_uploader(
-        "Carica il tuo file Excel (.xlsx, .xls) o CSV",
-        type=["xlsx", "xls", "csv"],
-        help="Il file deve contenere le colonne: Articolo, Colore, Taglia, Descrizione Articolo, Codice Gruppo, Barcode"
-    )
-
-    if uploaded_file is None:
-        st.info("Carica un file Excel o CSV per iniziare")
-        st.stop()
-
-    # Leggi i dati
-    try:
-        # Converti uploaded_file in BytesIO
-        file_bytes = io.BytesIO(uploaded_file.read())
-
-        # Determina il tipo di file dall'estensione
-        file_extension = Path(uploaded_file.name).suffix.lower()
-
-        if file_extension in [".xlsx", ".xls"]:
-            df, rows = read_excel_data(file_bytes, sheet=None)
-        elif file_extension == ".csv":
-            df, rows = read_excel_data(file_bytes, sep=",", encoding="utf-8")
-        else:
-            st.error("Formato file non supportato")
-            st.stop()
-
-    except Exception as e:
-        st.error(f"Errore nella lettura del file: {str(e)}")
-        st.stop()
-
-    # PHASE 6: Validate that Barcode column exists (required for selection tracking)
-    if 'Barcode' not in df.columns:
-        st.error("Il file unito deve contenere la colonna 'Barcode'")
-        st.info("Assicurati che il file EAN contenga la colonna 'Barcode'")
-        st.stop()
-
-    # PHASE 6: Validate Barcode uniqueness (critical for selection tracking)
-    # Check for duplicate Barcodes
-    duplicate_barcodes = df[df['Barcode'].duplicated(keep=False) & df['Barcode'].notna()]
-    if len(duplicate_barcodes) > 0:
-        st.error(f"Trovati {len(duplicate_barcodes)} prodotti con codici Barcode duplicati!")
-        st.warning("Ogni prodotto deve avere un codice Barcode univoco.")
-        st.dataframe(
-            duplicate_barcodes[['Articolo', 'Barcode', 'Descrizione Articolo', 'Colore', 'Taglia']].sort_values('Barcode'),
-            width='stretch'
-        )
-        st.info("Correggi i duplicati nel file EAN e ricarica.")
-        st.stop()
-
-    # Check for empty/missing Barcodes
-    empty_barcodes = df[df['Barcode'].isna() | (df['Barcode'] == "")]
-    if len(empty_barcodes) > 0:
-        st.error(f"Trovati {len(empty_barcodes)} prodotti senza codice Barcode!")
-        st.warning("Tutti i prodotti devono avere un codice Barcode.")
-        st.dataframe(
-            empty_barcodes[['Articolo', 'Descrizione Articolo', 'Colore', 'Taglia']].head(20),
-            width='stretch'
-        )
-        if len(empty_barcodes) > 20:
-            st.caption(f"... e altri {len(empty_barcodes) - 20} prodotti")
-        st.info("Aggiungi i Barcode mancanti nel file EAN e ricarica.")
-        st.stop()
-
-    # Mostra statistiche
-    st.success(f"File caricato con successo: **{uploaded_file.name}**")
-
-    # Sezione 2: Selezione Prodotti
-    st.header("2. Seleziona Prodotti")
-    st.caption(f"{len(rows)} prodotti totali nel file")
+            os.remove(path)
+        except OSError:
+            pass
 
-    # Store total count for selection summary
-    total_products = len(rows)
 
-    # Keep a full copy of df before filtering for counting all selections
-    df_full = df.copy()
+def _discard_generated_zip():
+    """Delete this session's generated ZIP and hide the download section."""
+    _remove_zip_file(st.session_state.pop('zip_path', None))
+    st.session_state.pop('num_labels', None)
+    st.session_state.pop('generated', None)
 
-    # PHASE 2 & 5: File upload change detection and state reset
-    # Track which file is currently loaded with fingerprint (name + row count)
-    current_fingerprint = (uploaded_file.name, len(df))
 
-    if 'uploaded_files' not in st.session_state:
-        st.session_state['uploaded_files'] = current_fingerprint
+def _remove_stale_zip_files():
+    """
+    Delete generated ZIPs older than ZIP_MAX_AGE_SECONDS.
 
-    # If file changed (name or content), reset all selection state
-    if st.session_state['uploaded_files'] != current_fingerprint:
-        st.session_state['selected_groups'] = []
-        st.session_state['selection_override'] = {}  # Now keyed by Barcode
-        st.session_state['selection_version'] = 0
-        st.session_state['groups_display_limit'] = 5
-        st.session_state['uploaded_files'] = current_fingerprint
+    Streamlit gives no hook when a session ends, so archives of abandoned
+    sessions are swept here, each time a new ZIP is generated.
+    """
+    cutoff = time.time() - ZIP_MAX_AGE_SECONDS
+    for path in Path(tempfile.gettempdir()).glob(f"{ZIP_PREFIX}*.zip"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            pass
 
-    # Initialize session state for selections if not exists
-    if 'selected_groups' not in st.session_state:
-        st.session_state['selected_groups'] = []
-    if 'selection_override' not in st.session_state:
-        st.session_state['selection_override'] = {}  # PHASE 1: Now keyed by Barcode (str), not index (int)
-    if 'desc_search' not in st.session_state:
-        st.session_state['desc_search'] = ""
-    if 'groups_display_limit' not in st.session_state:
-        st.session_state['groups_display_limit'] = 5
-    if 'selection_version' not in st.session_state:
-        st.session_state['selection_version'] = 0
 
-    # PHASE 3: Purge stale overrides (Barcodes no longer in current dataset)
-    # This prevents old selections from being inherited by new products with recycled Barcodes
-    current_barcodes = set(df_full['Barcode'].dropna().unique())
-    stale_barcodes = [bc for bc in st.session_state['selection_override'].keys()
-                      if bc not in current_barcodes]
-    for bc in stale_barcodes:
-        del st.session_state['selection_override'][bc]
+def _reset_product_editor():
+    """
+    Start the product data_editor from a clean state on the next render.
 
-    # Group filter
-    all_groups = sorted(df['Codice Gruppo'].unique()) if 'Codice Gruppo' in df.columns else []
+    data_editor state cannot be assigned through session_state, so the widget
+    key is versioned: bumping the version creates a fresh editor, and the
+    previous key's pending edits are dropped from session_state.
+    """
+    old_key = f"product_selector_{st.session_state['selection_version']}"
+    st.session_state['selection_version'] += 1
+    st.session_state.pop(old_key, None)
 
-    if all_groups:
-        # Calculate product counts per group
-        group_counts = df['Codice Gruppo'].value_counts().to_dict()
 
-        # Sort groups by product count (descending)
-        sorted_groups = sorted(all_groups, key=lambda g: group_counts.get(g, 0), reverse=True)
+@st.fragment
+def render_group_selector(sorted_groups, group_counts):
+    """
+    Render the group selector as a single searchable multiselect inside a form.
 
-        # Display groups as checkboxes in a grid
-        st.markdown("**Seleziona gruppi:**")
+    Picking several groups costs one rerun: changes are applied only when the
+    form is submitted. Added groups select all of their rows, removed groups
+    deselect them; either change triggers a full app rerun so the product
+    table and summary refresh.
 
-        # Search box for filtering groups (compact, no label, interactive)
-        search_term = st.text_input(
-            label="group_search_label",
+    Args:
+        sorted_groups: Group names sorted by product count (descending)
+        group_counts: Dict mapping group name to product count
+    """
+    previous = st.session_state['selected_groups']
+    if 'group_multiselect' not in st.session_state:
+        st.session_state['group_multiselect'] = list(previous)
+
+    # Form: the multiselect does not rerun on every pick, only on "Applica"
+    with st.form("group_filter", border=False):
+        chosen = st.multiselect(
+            label="group_select_label",
+            options=sorted_groups,
+            format_func=lambda group: f"{group} ({group_counts.get(group, 0)})",
             placeholder="Cerca gruppo...",
-            key="group_search_input",
+            key="group_multiselect",
             label_visibility="collapsed"
         )
+        submitted = st.form_submit_button("Applica Gruppi", width='stretch')
+
+    if not submitted:
+        return
+
+    added = set(chosen).difference(previous)
+    removed = set(previous).difference(chosen)
+    if added or removed:
+        st.session_state['selected_groups'] = list(chosen)
+
+        # PHASE 3: Set/clear ALL rows of the changed groups (full df, not the view)
+        selection_mask = st.session_state['selection_mask']
+        group_rows = st.session_state['file_index']['group_rows']
+        for group in added:
+            selection_mask[group_rows[group]] = True
+        for group in removed:
+            selection_mask[group_rows[group]] = False
+
+        # New editor key: the widget is recreated with clean state
+        _reset_product_editor()
+        # Selection changed: rerun the whole app so table and summary refresh
+        st.rerun()
 
-        # Determine which groups to display
-        if search_term:
-            # Search mode: show all matching groups
-            filtered_groups = [g for g in sorted_groups if search_term.lower() in g.lower()]
-            show_more_button = False
-        else:
-            # Normal mode: show top N groups based on display limit
-            display_limit = st.session_state.get('groups_display_limit', 5)
-            filtered_groups = sorted_groups[:display_limit]
-            remaining_groups = len(sorted_groups) - display_limit
-            show_more_button = remaining_groups > 0
-
-        # Create columns for checkbox grid (5 per row)
-        num_cols = 5
-        for i in range(0, len(filtered_groups), num_cols):
-            cols = st.columns(num_cols)
-            for j, col in enumerate(cols):
-                if i + j < len(filtered_groups):
-                    group = filtered_groups[i + j]
-                    count = group_counts.get(group, 0)
-                    with col:
-                        is_selected = group in st.session_state['selected_groups']
-                        checkbox_value = st.checkbox(f"{group} ({count})", value=is_selected, key=f"group_{group}")
-
-                        if checkbox_value != is_selected:
-                            # Group selection changed - update selected_groups and clear overrides for this group
-                            if checkbox_value:
-                                if group not in st.session_state['selected_groups']:
-                                    st.session_state['selected_groups'].append(group)
-                            else:
-                                if group in st.session_state['selected_groups']:
-                                    st.session_state['selected_groups'].remove(group)
-
-                            # PHASE 3: Clear selection_override for ALL products in this group (use df_full, not df)
-                            # Use Barcode-based tracking instead of index
-                            group_barcodes = df_full[df_full['Codice Gruppo'] == group]['Barcode'].dropna().tolist()
-                            for barcode in group_barcodes:
-                                if barcode in st.session_state['selection_override']:
-                                    del st.session_state['selection_override'][barcode]
-
-                            # Increment version to force widget recreation with clean state
-                            st.session_state['selection_version'] += 1
-                            # PHASE 7: Clear data_editor's edited_rows with correct versioned key
-                            widget_key = f'product_selector_{st.session_state["selection_version"] - 1}'
-                            if widget_key in st.session_state:
-                                del st.session_state[widget_key]
-
-        # Show "Mostra altri" or "Mostra meno" button
-        if show_more_button:
-            # There are more groups to show
-            col1, col2, col3 = st.columns([1, 1, 3])
-            with col1:
-                if st.button(f"Mostra altri ({remaining_groups})", key="show_more_groups", width='stretch'):
-                    st.session_state['groups_display_limit'] += 10
-                    st.rerun()
-            # Show collapse button if we've expanded beyond initial 5
-            if st.session_state.get('groups_display_limit', 5) > 5:
-                with col2:
-                    if st.button("Mostra meno", key="show_less_groups", width='stretch'):
-                        st.session_state['groups_display_limit'] = 5
-                        st.rerun()
-        elif st.session_state.get('groups_display_limit', 5) > 5:
-            # All groups shown but we're expanded - show only collapse button
-            if st.button("Mostra meno", key="show_less_groups_only", width='content'):
-                st.session_state['groups_display_limit'] = 5
-                st.rerun()
-
-        selected_groups = st.session_state['selected_groups']
-    else:
-        selected_groups = []
-        st.warning("Colonna 'Codice Gruppo' non trovata nel file")
 
-    # Create base selection state from group selections only
-    # This will be the "clean" base state for data_editor (no manual overrides)
-    if selected_groups:
-        base_selection = df['Codice Gruppo'].isin(selected_groups)
-        base_selection_full = df_full['Codice Gruppo'].isin(selected_groups)
-    else:
-        base_selection = pd.Series([False] * len(df), index=df.index)
-        base_selection_full = pd.Series([False] * len(df_full), index=df_full.index)
+@st.fragment
+def render_product_editor(df):
+    """
+    Render the product search, bulk actions and the paginated selection editor.
 
-    # Add selection column for display DataFrame (group selections only, no overrides yet)
-    if 'Selected' not in df.columns:
-        df.insert(0, 'Selected', base_selection)
+    Runs as a fragment: typing in the search box or changing page only reruns
+    this block. Applied selection changes are written into the selection mask
+    and trigger a full app rerun.
 
-    # For full DataFrame, combine group selections + manual overrides
-    if 'Selected' not in df_full.columns:
-        df_full.insert(0, 'Selected', base_selection_full)
+    Args:
+        df: Full product DataFrame (rows aligned with the selection mask)
+    """
+    selection_mask = st.session_state['selection_mask']
 
     # Product search box (searches both Articolo and Descrizione Articolo)
     desc_search = st.text_input(
@@ -406,15 +409,16 @@ def main():
     )
 
     # Filter dataframe by Articolo or Descrizione Articolo search
+    # Plain substring match (regex=False) in one pass over the pre-lowercased,
+    # newline-joined Articolo/Descrizione text
     if desc_search:
-        code_mask = df['Articolo'].str.contains(desc_search, case=False, na=False)
-        desc_mask = df['Descrizione Articolo'].str.contains(desc_search, case=False, na=False)
-        combined_mask = code_mask | desc_mask  # OR condition - match either column
-        df = df[combined_mask].copy()
-        # Store original indices before resetting
-        df['_original_index'] = df.index
-        # Reset index to avoid KeyError when accessing rows by position
-        df.reset_index(drop=True, inplace=True)
+        term = desc_search.lower()
+        search_lc = st.session_state['file_index']['search_lc']
+        view_rows = np.flatnonzero(search_lc.str.contains(term, regex=False, na=False).to_numpy(dtype=bool))
+        df_view = df.iloc[view_rows]
+    else:
+        view_rows = np.arange(len(df))
+        df_view = df
 
     # PHASE 4: Bulk action buttons with explicit scope
     # Make button text explicit about whether it affects filtered or all products
@@ -426,34 +430,20 @@ def main():
 
     with link_col2:
         if st.button(select_text, key="select_all_btn", help="Seleziona i prodotti mostrati", width='stretch'):
-            # PHASE 1: Use Barcode-based tracking instead of index
-            # Get Barcodes from currently displayed df (filtered or full)
-            barcodes_to_select = df['Barcode'].dropna().tolist()
-            for barcode in barcodes_to_select:
-                st.session_state['selection_override'][barcode] = True
-
-            # Increment version to force widget recreation with clean state
-            st.session_state['selection_version'] += 1
-            # PHASE 7: Clear data_editor's edited_rows with correct versioned key
-            widget_key = f'product_selector_{st.session_state["selection_version"] - 1}'
-            if widget_key in st.session_state:
-                del st.session_state[widget_key]
+            # PHASE 1: One vectorized write over the currently displayed rows (filtered or full)
+            selection_mask[view_rows] = True
+
+            # New editor key: the widget is recreated with clean state
+            _reset_product_editor()
             st.rerun()
 
     with link_col3:
         if st.button(deselect_text, key="clear_all_btn", help="Deseleziona i prodotti mostrati", width='stretch'):
-            # PHASE 1: Use Barcode-based tracking instead of index
-            # Get Barcodes from currently displayed df (filtered or full)
-            barcodes_to_deselect = df['Barcode'].dropna().tolist()
-            for barcode in barcodes_to_deselect:
-                st.session_state['selection_override'][barcode] = False
-
-            # Increment version to force widget recreation with clean state
-            st.session_state['selection_version'] += 1
-            # PHASE 7: Clear data_editor's edited_rows with correct versioned key
-            widget_key = f'product_selector_{st.session_state["selection_version"] - 1}'
-            if widget_key in st.session_state:
-                del st.session_state[widget_key]
+            # PHASE 1: One vectorized write over the currently displayed rows (filtered or full)
+            selection_mask[view_rows] = False
+
+            # New editor key: the widget is recreated with clean state
+            _reset_product_editor()
             st.rerun()
 
     # Interactive data editor wrapped in form to prevent rerun on every click
@@ -470,36 +460,44 @@ def main():
         )
     }
 
-    # Hide _original_index column if it exists
-    if '_original_index' in df.columns:
-        column_config["_original_index"] = None
-
-    # PHASE 1: Apply manual overrides to df to show current state in form
-    # Now using Barcode-based tracking instead of index
-    for barcode, override_value in st.session_state.get('selection_override', {}).items():
-        # Find row(s) with this Barcode in the displayed df
-        matching_rows = df[df['Barcode'] == barcode]
-        if len(matching_rows) > 0:
-            # Get the index in the displayed df (may be reset index if filtered)
-            display_idx = matching_rows.index[0]
-            df.at[display_idx, 'Selected'] = override_value
+    # Paginate the editor: only one window of rows is serialized to the browser.
+    # Selections live in the full-length mask, so switching page never loses state.
+    num_pages = max(1, -(-len(df_view) // PRODUCT_PAGE_SIZE))
+    if st.session_state.get('product_page', 1) > num_pages:
+        st.session_state['product_page'] = num_pages
+    if num_pages > 1:
+        page = st.number_input(
+            f"Pagina (di {num_pages})",
+            min_value=1,
+            max_value=num_pages,
+            step=1,
+            key="product_page",
+            on_change=_reset_product_editor
+        )
+    else:
+        page = 1
+    page_start = (page - 1) * PRODUCT_PAGE_SIZE
+    page_rows = view_rows[page_start:page_start + PRODUCT_PAGE_SIZE]
 
-    # Store input df for comparison (to detect NEW changes)
-    df_before_edit = df.copy()
+    # Snapshot the page's selection for comparison (to detect NEW changes);
+    # assign does not mutate df and, with Copy-on-Write, does not copy its columns
+    before_selected = selection_mask[page_rows]
+    df_page = df_view.iloc[page_start:page_start + PRODUCT_PAGE_SIZE].assign(Selected=before_selected)
 
     # Wrap data_editor in form to prevent rerun on every click
     # This solves both disappearing checkbox and scroll reset issues
-    # PHASE 4: Note - table sorting is not officially disabled but comparison uses Barcode
-    # so sorting won't break selections (comparisons are by identifier, not position)
+    # PHASE 4: Note - table sorting in the UI is display-only: data_editor returns
+    # rows in input order, so a positional diff maps back to the right rows
     with st.form("product_selection_form", clear_on_submit=False):
-        # Pass df with current selection state (group + manual overrides)
+        # Pass df with current selection state
         # Form prevents rerun until submit button is clicked
         edited_df = st.data_editor(
-            df,
+            df_page,
             width='stretch',
             hide_index=True,
             column_config=column_config,
-            disabled=[col for col in df.columns if col not in ['Selected']],
+            column_order=['Selected', *df.columns],
+            disabled=[col for col in df_page.columns if col not in ['Selected']],
             key=f"product_selector_{st.session_state['selection_version']}"
         )
 
@@ -507,153 +505,73 @@ def main():
         submitted = st.form_submit_button("Applica Selezioni", width='stretch', type="primary")
 
     # PHASE 2: Process changes when form is submitted
-    # Use Barcode-based lookup instead of positional index to handle sorting/reordering
-    manual_selections = {}
+    # One vectorized compare against the snapshot, then write only the changed rows
     if submitted:
-        # Build lookup dicts keyed by Barcode (not positional index)
-        before_dict = {}
-        for _, row in df_before_edit.iterrows():
-            if pd.notna(row.get('Barcode')):
-                before_dict[row['Barcode']] = row['Selected']
-
-        after_dict = {}
-        for _, row in edited_df.iterrows():
-            if pd.notna(row.get('Barcode')):
-                after_dict[row['Barcode']] = row['Selected']
-
-        # Compare by Barcode, not position - this handles table sorting correctly
-        for barcode in after_dict.keys():
-            if barcode in before_dict:
-                if before_dict[barcode] != after_dict[barcode]:
-                    manual_selections[barcode] = after_dict[barcode]
-
-    # PHASE 1: Build final selection state for full dataset
-    # Priority: manual_selections > selection_override > group_selections
-    # Now using Barcode-based tracking
-    df_full_final = df_full.copy()
-
-    # Start with group selections (already in df_full['Selected'])
-    # Then apply stored overrides from previous sessions/filters
-    for barcode, override_value in st.session_state.get('selection_override', {}).items():
-        # Find row with this Barcode in df_full
-        matching_rows = df_full_final[df_full_final['Barcode'] == barcode]
-        if len(matching_rows) > 0:
-            idx = matching_rows.index[0]
-            df_full_final.at[idx, 'Selected'] = override_value
-
-    # Finally apply current manual selections (highest priority)
-    for barcode, manual_value in manual_selections.items():
-        # Find row with this Barcode in df_full
-        matching_rows = df_full_final[df_full_final['Barcode'] == barcode]
-        if len(matching_rows) > 0:
-            idx = matching_rows.index[0]
-            df_full_final.at[idx, 'Selected'] = manual_value
-            # Also update selection_override to persist this choice
-            st.session_state['selection_override'][barcode] = manual_value
-
-    # PHASE 5: Prune redundant overrides that match group baseline
-    # This prevents the override dict from growing unbounded
-    barcodes_to_remove = []
-    for barcode, override_value in st.session_state.get('selection_override', {}).items():
-        # Find this product's group
-        product_rows = df_full_final[df_full_final['Barcode'] == barcode]
-        if len(product_rows) > 0:
-            group = product_rows.iloc[0]['Codice Gruppo']
-            group_selected = group in st.session_state['selected_groups']
-            # If override matches group baseline, it's redundant
-            if override_value == group_selected:
-                barcodes_to_remove.append(barcode)
-
-    # Remove redundant overrides
-    for barcode in barcodes_to_remove:
-        del st.session_state['selection_override'][barcode]
-
-    # If manual selections were made, reset widget state and rerun for clean state
-    if manual_selections:
-        # Increment version to force widget recreation with clean state
-        st.session_state['selection_version'] += 1
-        # PHASE 7: Clear data_editor's edited_rows with correct versioned key
-        widget_key = f"product_selector_{st.session_state['selection_version'] - 1}"
-        if widget_key in st.session_state:
-            del st.session_state[widget_key]
+        after_selected = edited_df['Selected'].to_numpy(dtype=bool)
+        changed = np.flatnonzero(before_selected != after_selected)
+    else:
+        changed = np.empty(0, dtype=np.intp)
+
+    # If manual selections were made, persist them and rerun for clean state
+    if changed.size:
+        selection_mask[page_rows[changed]] = after_selected[changed]
+        # New editor key: the widget is recreated with clean state
+        _reset_product_editor()
+        # Rerun the whole app so the summary refreshes
         st.rerun()
 
-    # Selection summary - count from full dataset
-    num_selected_total = int(df_full_final['Selected'].sum())
-    st.info(f"**{num_selected_total}** di **{total_products}** prodotti selezionati")
-
-    if num_selected_total == 0:
-        st.warning("Nessun prodotto selezionato. Seleziona almeno un prodotto per continuare.")
-        st.stop()
-
-    # Filter rows to only selected ones from the final dataset
-    selected_mask = df_full_final['Selected'] == True
-    selected_df = df_full_final[selected_mask].copy()
-    selected_df = selected_df.drop(columns=['Selected'])  # Remove selection column
-
-    # Remove _original_index if it exists
-    if '_original_index' in selected_df.columns:
-        selected_df = selected_df.drop(columns=['_original_index'])
-
-    selected_rows = selected_df.to_dict(orient="records")
-
-    # Pattern fisso e genera tutte le etichette
-    filename_pattern = DEFAULT_FILENAME_PATTERN
-    limit_labels = 0
-
-    # Sezione 3: Validazione
-    st.header("3. Validazione")
 
-    try:
-        template_xml = read_template(TEMPLATE_PATH)
-
-        # Transform real column names to template placeholders
-        selected_rows_transformed = transform_for_template(selected_rows)
-
-        validation = validate_data(template_xml, selected_rows_transformed)
-
-        # Verifica validazione
-        if not validation['is_valid']:
-            st.error("Validazione fallita!")
-            st.write("**Placeholder mancanti nei dati:**")
-            for missing in validation['missing']:
-                st.write(f"- `{missing}`")
-            st.warning("Il file Excel deve contenere tutte le colonne richieste dal template.")
-            st.stop()
-        else:
-            st.success("Validazione completata! Tutti i placeholder hanno colonne corrispondenti.")
+@st.fragment
+def render_generation(template_xml, selected_rows_transformed, filename_pattern):
+    """
+    Render the label generation button and the download section.
 
-    except Exception as e:
-        st.error(f"Errore nella validazione: {str(e)}")
-        st.stop()
+    Runs as a fragment: clicking "Genera" or the download button only reruns
+    this block, not the upload, selection and validation sections above.
 
+    Args:
+        template_xml: Validated template XML
+        selected_rows_transformed: Selected rows with template column names
+        filename_pattern: Pattern for the .dymo file names inside the ZIP
+    """
     # Sezione 4: Generazione
     st.header("4. Genera Etichette")
 
     # Genera solo le etichette selezionate
-    num_labels = len(selected_rows)
+    num_labels = len(selected_rows_transformed)
 
     # Bottone genera
     if st.button(f"Genera {num_labels} Etichette Selezionate", type="primary", width="stretch"):
         try:
             with st.spinner(f"Generazione di {num_labels} etichette in corso..."):
-                # Genera etichette (usa dati trasformati)
-                labels = generate_labels(
+                # Genera etichette (usa dati trasformati) e scrivile direttamente
+                # in un file ZIP temporaneo: in memoria resta solo il percorso
+                labels = iter_labels(
                     template_xml,
                     selected_rows_transformed,
                     filename_pattern,
                     limit=None
                 )
-
-                # Crea ZIP
-                zip_buffer = create_zip_archive(labels)
+                tmp_zip = tempfile.NamedTemporaryFile(prefix=ZIP_PREFIX, suffix=".zip", delete=False)
+                try:
+                    with tmp_zip:
+                        create_zip_archive(labels, tmp_zip)
+                except Exception:
+                    # Non lasciare su disco un archivio incompleto
+                    _remove_zip_file(tmp_zip.name)
+                    raise
+
+                # Rimuovi lo ZIP di una generazione precedente e quelli
+                # rimasti da sessioni abbandonate
+                _remove_zip_file(st.session_state.get('zip_path'))
+                _remove_stale_zip_files()
 
                 # Salva in session state per download
-                st.session_state['zip_file'] = zip_buffer
-                st.session_state['num_labels'] = len(labels)
+                st.session_state['zip_path'] = tmp_zip.name
+                st.session_state['num_labels'] = num_labels
                 st.session_state['generated'] = True
 
-            st.success(f"{len(labels)} etichette generate con successo!")
+            st.success(f"{num_labels} etichette generate con successo!")
 
         except Exception as e:
             st.error(f"Errore durante la generazione: {str(e)}")
@@ -663,15 +581,23 @@ def main():
     if st.session_state.get('generated', False):
         st.header("5. Download")
 
-        zip_data = st.session_state['zip_file']
         num_labels = st.session_state['num_labels']
 
         # Genera nome file ZIP
         zip_filename = f"etichette_dymo_{num_labels}_labels.zip"
 
+        zip_path = Path(st.session_state['zip_path'])
+        if not zip_path.exists():
+            # Rimosso dalla pulizia degli ZIP scaduti
+            _discard_generated_zip()
+            st.warning("L'archivio generato è scaduto: genera di nuovo le etichette.")
+            return
+
+        # Download differito: Streamlit chiama read_bytes solo al click. Un file
+        # aperto verrebbe invece letto e copiato in memoria a ogni rerun
         st.download_button(
             label=f"Scarica {num_labels} Etichette (ZIP)",
-            data=zip_data,
+            data=zip_path.read_bytes,
             file_name=zip_filename,
             mime="application/zip",
             type="primary",
@@ -689,6 +615,204 @@ def main():
             4. Stampa le etichette sulla tua stampante DYMO
             """)
 
+
+def main():
+    # Header con Logo
+    col1, col2, col3 = st.columns([1, 2, 1])
+    with col2:
+        try:
+            st.image("logo.png", width=300)
+        except:
+            st.title("BAMBOOM")
+
+    st.markdown("<h2 style='text-align: center;'>Generatore Etichette DYMO</h2>", unsafe_allow_html=True)
+    st.markdown("<p style='text-align: center; color: #8E8E8E;'>Carica il tuo file Excel e genera le etichette DYMO</p>", unsafe_allow_html=True)
+    st.divider()
+
+    # Verifica che il template esista
+    if not TEMPLATE_PATH.exists():
+        st.error(f"Template non trovato: {TEMPLATE_PATH}")
+        st.info("Assicurati che il file `template_bamboom.dymo` sia presente nella cartella del progetto.")
+        st.stop()
+
+    # Sezione 1: Upload file
+    st.header("1. Carica File Excel")
+    uploaded_file = st.file_uploader(
+        "Carica il tuo file Excel (.xlsx, .xls) o CSV",
+        type=["xlsx", "xls", "csv"],
+        help="Il file deve contenere le colonne: Articolo, Colore, Taglia, Descrizione Articolo, Codice Gruppo, Barcode"
+    )
+
+    if uploaded_file is None:
+        st.info("Carica un file Excel o CSV per iniziare")
+        st.stop()
+
+    # Leggi i dati
+    # Determina il tipo di file dall'estensione
+    file_extension = Path(uploaded_file.name).suffix.lower()
+    if file_extension not in [".xlsx", ".xls", ".csv"]:
+        st.error("Formato file non supportato")
+        st.stop()
+
+    # Il digest del contenuto fa da chiave di cache: il parsing avviene una
+    # sola volta per file e il digest viene calcolato una volta per upload
+    file_digest = _upload_digest(uploaded_file)
+    try:
+        df = _load_df(file_digest, file_extension, uploaded_file)
+
+    except Exception as e:
+        st.error(f"Errore nella lettura del file: {str(e)}")
+        st.stop()
+
+    # PHASE 6: Validate that Barcode column exists (required on every label)
+    if 'Barcode' not in df.columns:
+        st.error("Il file unito deve contenere la colonna 'Barcode'")
+        st.info("Assicurati che il file EAN contenga la colonna 'Barcode'")
+        st.stop()
+
+    # PHASE 6: Validate Barcode uniqueness (one label per product)
+    # Compute both masks as numpy arrays without converting the column;
+    # filtered DataFrames are only built on error
+    barcodes = df['Barcode']
+    empty_mask = (barcodes.isna() | (barcodes == "")).to_numpy(dtype=bool, na_value=True)
+    dup_mask = barcodes.duplicated(keep=False).to_numpy() & ~empty_mask
+
+    # Check for duplicate Barcodes
+    num_duplicates = int(dup_mask.sum())
+    if num_duplicates:
+        st.error(f"Trovati {num_duplicates} prodotti con codici Barcode duplicati!")
+        st.warning("Ogni prodotto deve avere un codice Barcode univoco.")
+        st.dataframe(
+            df.loc[dup_mask, ['Articolo', 'Barcode', 'Descrizione Articolo', 'Colore', 'Taglia']].sort_values('Barcode'),
+            width='stretch'
+        )
+        st.info("Correggi i duplicati nel file EAN e ricarica.")
+        st.stop()
+
+    # Check for empty/missing Barcodes
+    num_empty = int(empty_mask.sum())
+    if num_empty:
+        st.error(f"Trovati {num_empty} prodotti senza codice Barcode!")
+        st.warning("Tutti i prodotti devono avere un codice Barcode.")
+        st.dataframe(
+            df.loc[empty_mask, ['Articolo', 'Descrizione Articolo', 'Colore', 'Taglia']].head(20),
+            width='stretch'
+        )
+        if num_empty > 20:
+            st.caption(f"... e altri {num_empty - 20} prodotti")
+        st.info("Aggiungi i Barcode mancanti nel file EAN e ricarica.")
+        st.stop()
+
+    # Mostra statistiche
+    st.success(f"File caricato con successo: **{uploaded_file.name}**")
+
+    # Sezione 2: Selezione Prodotti
+    st.header("2. Seleziona Prodotti")
+    st.caption(f"{len(df)} prodotti totali nel file")
+
+    # Store total count for selection summary
+    total_products = len(df)
+
+    # df stays the full dataset; search filtering only builds a display view
+
+    # PHASE 2 & 5: File upload change detection and state reset
+    # Track which file is currently loaded with fingerprint (name + content digest)
+    current_fingerprint = (uploaded_file.name, file_digest)
+
+    if 'uploaded_files' not in st.session_state:
+        st.session_state['uploaded_files'] = current_fingerprint
+
+    # If file changed (name or content), reset all selection state
+    if st.session_state['uploaded_files'] != current_fingerprint:
+        st.session_state['selected_groups'] = []
+        st.session_state['selection_mask'] = np.zeros(len(df), dtype=bool)
+        st.session_state['selection_version'] = 0
+        st.session_state.pop('group_multiselect', None)
+        # Lo ZIP generato riguarda il file precedente
+        _discard_generated_zip()
+        st.session_state['uploaded_files'] = current_fingerprint
+
+    # Initialize session state for selections if not exists
+    if 'selected_groups' not in st.session_state:
+        st.session_state['selected_groups'] = []
+    if 'selection_mask' not in st.session_state:
+        st.session_state['selection_mask'] = np.zeros(len(df), dtype=bool)  # PHASE 1: aligned with df rows
+    if 'desc_search' not in st.session_state:
+        st.session_state['desc_search'] = ""
+    if 'selection_version' not in st.session_state:
+        st.session_state['selection_version'] = 0
+
+    # Group rows, group counts/order and search column depend only on the
+    # uploaded file: fetch them once per file
+    if st.session_state.get('file_index_file') != current_fingerprint:
+        st.session_state['file_index'] = _load_file_index(file_digest, file_extension, uploaded_file)
+        st.session_state['file_index_file'] = current_fingerprint
+    file_index = st.session_state['file_index']
+
+    # Group filter
+    group_counts = file_index['group_counts']
+    sorted_groups = file_index['sorted_groups']
+
+    if sorted_groups:
+        # Display groups in a single searchable multiselect
+        st.markdown("**Seleziona gruppi:**")
+
+        render_group_selector(sorted_groups, group_counts)
+    else:
+        st.warning("Colonna 'Codice Gruppo' non trovata nel file")
+
+    render_product_editor(df)
+
+    # PHASE 1: The mask is the full selection (groups, bulk actions and manual edits)
+    selected_full = st.session_state['selection_mask']
+
+    # Selection summary - count from full dataset
+    num_selected_total = int(np.count_nonzero(selected_full))
+    st.info(f"**{num_selected_total}** di **{total_products}** prodotti selezionati")
+
+    if num_selected_total == 0:
+        st.warning("Nessun prodotto selezionato. Seleziona almeno un prodotto per continuare.")
+        st.stop()
+
+    # Filter rows to only selected ones from the full dataset (one positional gather)
+    selected_df = df.iloc[np.flatnonzero(selected_full)]
+
+    # Pattern fisso e genera tutte le etichette
+    filename_pattern = DEFAULT_FILENAME_PATTERN
+    limit_labels = 0
+
+    # Sezione 3: Validazione
+    st.header("3. Validazione")
+
+    try:
+        # Template and validation are cached: reruns skip disk I/O and placeholder extraction
+        template_mtime = TEMPLATE_PATH.stat().st_mtime_ns if TEMPLATE_PATH.exists() else None
+        template_xml = _load_template(str(TEMPLATE_PATH), template_mtime)
+
+        # Transform real column names to template placeholders
+        selected_rows_transformed = transform_for_template(selected_df)
+
+        # Validation only looks at column names
+        validation = _validate_columns(template_xml, tuple(selected_rows_transformed.columns))
+
+        # Verifica validazione
+        if not validation['is_valid']:
+            st.error("Validazione fallita!")
+            st.write("**Placeholder mancanti nei dati:**")
+            for missing in validation['missing']:
+                st.write(f"- `{missing}`")
+            st.warning("Il file Excel deve contenere tutte le colonne richieste dal template.")
+            st.stop()
+        else:
+            st.success("Validazione completata! Tutti i placeholder hanno colonne corrispondenti.")
+
+    except Exception as e:
+        st.error(f"Errore nella validazione: {str(e)}")
+        st.stop()
+
+    # Sezioni 4-5: generazione e download (fragment)
+    render_generation(template_xml, selected_rows_transformed, filename_pattern)
+
     # Footer
     st.divider()
     st.caption("Bamboom - Generatore Etichette DYMO | Versione 1.0")
@@ -9,10 +9,11 @@ from pathlib import Path
 from utils import (
     read_template,
     extract_placeholders,
-    read_excel_data,
+    read_data_frame,
     merge_product_ean_data,
-    validate_data,
-    generate_labels
+    validate_columns,
+    iter_labels,
+    create_zip_archive
 )
 
 
@@ -25,6 +26,8 @@ def main():
     ap.add_argument("--sep", default=",", help="Separatore CSV (default ,)")
     ap.add_argument("--encoding", default="utf-8", help="Encoding CSV (default utf-8)")
     ap.add_argument("--out", default="out", type=Path, help="Cartella output")
+    ap.add_argument("--zip", type=Path, default=None,
+                    help="Scrivi le etichette in un unico archivio ZIP invece che nella cartella output")
     ap.add_argument("--name", default="{Code}_{Color}_{Size}.dymo",
                     help="Pattern nome file; usa intestazioni colonna. {i} è indice 1-based")
     ap.add_argument("--limit", type=int, default=None, help="Processa solo le prime N righe")
@@ -40,7 +43,7 @@ def main():
 
     # Leggi dati prodotti
     try:
-        df, rows = read_excel_data(args.data, args.sheet, args.sep, args.encoding)
+        df = read_data_frame(args.data, args.sheet, args.sep, args.encoding)
     except (FileNotFoundError, ValueError) as e:
         print(str(e), file=sys.stderr)
         sys.exit(1)
@@ -48,9 +51,8 @@ def main():
     # Se presente file EAN, uniscilo ai dati prodotti
     if args.ean_data:
         try:
-            ean_df, _ = read_excel_data(args.ean_data, args.sheet, args.sep, args.encoding)
+            ean_df = read_data_frame(args.ean_data, args.sheet, args.sep, args.encoding)
             df, merge_stats = merge_product_ean_data(df, ean_df)
-            rows = df.to_dict(orient="records")
 
             print(f"Unione completata: {merge_stats['total']} prodotti totali, "
                   f"{merge_stats['matched']} con EAN, {merge_stats['unmatched']} senza EAN")
@@ -64,14 +66,14 @@ def main():
 
     # Applica limite
     if args.limit:
-        rows = rows[:args.limit]
+        df = df.head(args.limit)
 
-    if not rows:
+    if df.empty:
         print("Dati vuoti: nessuna riga da processare.", file=sys.stderr)
         sys.exit(0)
 
-    # Valida dati
-    validation = validate_data(template_xml, rows)
+    # Valida dati (la validazione guarda solo i nomi delle colonne)
+    validation = validate_columns(template_xml, df.columns)
 
     print(f"Placeholder nel template: {sorted(validation['placeholders'])}")
     print(f"Colonne nei dati:        {sorted(validation['columns'])}")
@@ -84,27 +86,36 @@ def main():
 
     if args.dry_run:
         # Genera solo il primo per mostrare esempio
-        labels = generate_labels(template_xml, rows, args.name, limit=1)
-        if labels:
-            filename, content = labels[0]
+        first_label = next(iter_labels(template_xml, df, args.name, limit=1), None)
+        if first_label:
+            filename, content = first_label
             print("\n--- DRY RUN ---")
             print("Esempio nome file:", filename)
             snippet = content[:400].replace("\n", " ")
             print("Estratto label XML:", snippet + ("..." if len(content) > 400 else ""))
         sys.exit(0)
 
-    # Genera tutte le etichette
-    labels = generate_labels(template_xml, rows, args.name, args.limit)
+    if args.zip:
+        # Un solo file di output: niente apertura/chiusura di un file per etichetta
+        args.zip.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.zip, "wb") as zip_file:
+            create_zip_archive(iter_labels(template_xml, df, args.name), zip_file)
+        print(f"Archiviati {len(df)} file in: {args.zip.resolve()}")
+        return
 
     # Crea cartella output
     args.out.mkdir(parents=True, exist_ok=True)
 
-    # Scrivi file
-    for filename, content in labels:
+    # Genera le etichette e scrivi ogni file appena pronto: in memoria
+    # resta una sola etichetta alla volta
+    num_labels = 0
+    for filename, content in iter_labels(template_xml, df, args.name):
         output_path = args.out / filename
-        output_path.write_text(content, encoding="utf-8")
+        # write_bytes evita il wrapper di testo (encoder e buffer) per ogni file
+        output_path.write_bytes(content.encode("utf-8"))
+        num_labels += 1
 
-    print(f"Creati {len(labels)} file in: {args.out.resolve()}")
+    print(f"Creati {num_labels} file in: {args.out.resolve()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,8 @@
+"""
+Configurazione pytest: rende importabili i moduli nella root del progetto.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,162 @@
+"""
+Test per le funzioni di lettura dati e generazione etichette in utils.py.
+"""
+
+import io
+import zipfile
+from pathlib import Path
+
+import openpyxl
+import pandas as pd
+import pytest
+
+from utils import (
+    compile_template,
+    create_zip_archive,
+    fill_compiled_template,
+    fill_template,
+    read_data_frame,
+    read_template,
+    validate_columns,
+    validate_data,
+)
+
+
+TEMPLATE_PATH = Path(__file__).resolve().parent.parent / "template_update_final.dymo"
+
+
+def _csv_buffer(text: str) -> io.BytesIO:
+    return io.BytesIO(text.encode("utf-8"))
+
+
+def _xlsx_buffer(rows) -> io.BytesIO:
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+
+def _fill_compiled(template_xml: str, row) -> str:
+    return fill_compiled_template(compile_template(template_xml), row)
+
+
+def test_read_csv_keeps_leading_zeros_and_numeric_text():
+    data = _csv_buffer(
+        "Articolo,Barcode,Taglia,Prezzo\n"
+        "0012345,0800123456789,3,3.50\n"
+    )
+
+    df = read_data_frame(data, suffix=".csv")
+
+    assert df.iloc[0].tolist() == ["0012345", "0800123456789", "3", "3.50"]
+
+
+def test_read_csv_column_filter_keeps_leading_zeros():
+    data = _csv_buffer("Articolo,Barcode,Extra\n0012345,0800123456789,x\n")
+
+    df = read_data_frame(data, suffix=".csv", columns=["Articolo", "Barcode", "Colore"])
+
+    assert list(df.columns) == ["Articolo", "Barcode"]
+    assert df.iloc[0].tolist() == ["0012345", "0800123456789"]
+
+
+def test_read_excel_keeps_leading_zeros_and_numeric_text():
+    data = _xlsx_buffer([
+        ["Articolo", "Barcode", "Taglia", "Prezzo"],
+        ["0012345", "0800123456789", 3, 3.5],
+        [12345, 800123456789, 42, 3.0],
+    ])
+
+    df = read_data_frame(data, suffix=".xlsx")
+
+    assert df.iloc[0].tolist() == ["0012345", "0800123456789", "3", "3.5"]
+    assert df.iloc[1].tolist() == ["12345", "800123456789", "42", "3"]
+
+
+def test_read_data_frame_fills_empty_cells():
+    data = _csv_buffer("Articolo,Colore\n0012345,\n")
+
+    df = read_data_frame(data, suffix=".csv")
+
+    assert df.iloc[0].tolist() == ["0012345", ""]
+
+
+def test_read_excel_falls_back_when_calamine_engine_is_unknown(monkeypatch):
+    real_read_excel = pd.read_excel
+
+    def read_excel_without_calamine(*args, **kwargs):
+        if kwargs.get("engine") == "calamine":
+            raise ValueError("Unknown engine: calamine")
+        return real_read_excel(*args, **kwargs)
+
+    monkeypatch.setattr(pd, "read_excel", read_excel_without_calamine)
+    data = _xlsx_buffer([["Articolo", "Barcode"], ["0012345", "0800123456789"]])
+
+    df = read_data_frame(data, suffix=".xlsx")
+
+    assert df.iloc[0].tolist() == ["0012345", "0800123456789"]
+
+
+def test_read_csv_accepts_multi_character_separator():
+    data = _csv_buffer("Articolo;;Barcode\n0012345;;0800123456789\n")
+
+    df = read_data_frame(data, sep=";;", suffix=".csv")
+
+    assert df.iloc[0].tolist() == ["0012345", "0800123456789"]
+
+
+@pytest.mark.parametrize("row", [
+    {"Code": "0012345", "Color": "Nero", "Size": "42", "Desc": "Maglia", "Barcode": "0800123456789"},
+    {"Code": "A&B", "Color": "<rosso>", "Size": "", "Desc": "Tom & Jerry > 3", "Barcode": "8001"},
+    {"Code": "0012345", "Size": "3"},
+])
+def test_compiled_template_matches_fill_template(row):
+    template_xml = read_template(TEMPLATE_PATH)
+
+    expected = fill_template(template_xml, row)
+
+    assert _fill_compiled(template_xml, row).encode("utf-8") == expected.encode("utf-8")
+
+
+@pytest.mark.parametrize("fill", [fill_template, _fill_compiled])
+def test_fill_escapes_xml_special_characters(fill):
+    template_xml = "<String>{{Desc}}</String>"
+
+    result = fill(template_xml, {"Desc": "Tom & Jerry <3> 'ok'"})
+
+    assert result == "<String>Tom &amp; Jerry &lt;3&gt; 'ok'</String>"
+
+
+@pytest.mark.parametrize("fill", [fill_template, _fill_compiled])
+def test_fill_leaves_unmatched_placeholders_unchanged(fill):
+    template_xml = "<String>{{Code}}-{{Colore}}</String>{{Code}}"
+
+    result = fill(template_xml, {"Code": "0012345"})
+
+    assert result == "<String>0012345-{{Colore}}</String>0012345"
+
+
+def test_create_zip_archive_defaults_to_bytes_io():
+    labels = iter([("a.dymo", "<a/>"), ("b.dymo", "<b>&amp;</b>")])
+
+    zip_buffer = create_zip_archive(labels)
+
+    assert isinstance(zip_buffer, io.BytesIO)
+    with zipfile.ZipFile(io.BytesIO(zip_buffer.getvalue())) as archive:
+        assert archive.namelist() == ["a.dymo", "b.dymo"]
+        assert archive.read("b.dymo") == b"<b>&amp;</b>"
+
+
+def test_validate_data_delegates_to_validate_columns():
+    template_xml = "<a>{{Code}}</a><b>{{Size}}</b>"
+
+    by_columns = validate_columns(template_xml, ["Code", "Extra"])
+
+    assert by_columns == validate_data(template_xml, [{"Code": "0012345", "Extra": ""}])
+    assert by_columns["missing"] == ["Size"]
+    assert by_columns["unused"] == ["Extra"]
+    assert not by_columns["is_valid"]
@@ -7,13 +7,17 @@ import io
 import re
 import zipfile
 from pathlib import Path
-from typing import Dict, List, Set, Tuple, Optional, Union
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Set, Tuple, Optional, Union
 import pandas as pd
 from xml.sax.saxutils import escape as xml_escape
 
 
 PLACEHOLDER_RX = re.compile(r"\{\{(\w+)\}\}")
 
+# Caratteri non ammessi e spazi nei nomi file (vedi sanitize_filename)
+UNSAFE_FILENAME_RX = re.compile(r"[^\w\-. ]+")
+WHITESPACE_RX = re.compile(r"\s+")
+
 
 def read_template(template_path: Union[str, Path]) -> str:
     """
@@ -47,23 +51,110 @@ def extract_placeholders(xml_content: str) -> Set[str]:
     return set(PLACEHOLDER_RX.findall(xml_content))
 
 
-def read_excel_data(
+def _read_excel_frame(
+    file_obj,
+    sheet_name: Union[str, int],
+    suffix: str,
+    columns: Optional[Set[str]] = None
+) -> pd.DataFrame:
+    """
+    Legge un foglio Excel usando il motore più veloce disponibile.
+
+    Prova prima `calamine` (python-calamine, parser Rust); se non è installato,
+    o se la versione di pandas non conosce il motore (serve pandas >= 2.2),
+    ripiega su openpyxl per .xlsx (che pandas apre già in read_only/data_only)
+    o sul motore predefinito per .xls.
+
+    Args:
+        file_obj: Percorso o buffer del file Excel
+        sheet_name: Nome o indice del foglio
+        suffix: Estensione del file (".xlsx" o ".xls")
+        columns: Colonne da leggere (None = tutte); quelle assenti vengono ignorate
+
+    Returns:
+        DataFrame con tutte le celle come stringhe
+    """
+    usecols = columns.__contains__ if columns is not None else None
+    try:
+        return pd.read_excel(file_obj, sheet_name=sheet_name, dtype=str, usecols=usecols, engine="calamine")
+    except (ImportError, ValueError):
+        # ValueError: "Unknown engine: calamine" su pandas < 2.2; altri errori
+        # di lettura si ripresentano identici con il motore di ripiego.
+        # Un buffer va riportato all'inizio dopo il tentativo fallito
+        if hasattr(file_obj, "seek"):
+            file_obj.seek(0)
+
+    engine = "openpyxl" if suffix == ".xlsx" else None
+    return pd.read_excel(file_obj, sheet_name=sheet_name, dtype=str, usecols=usecols, engine=engine)
+
+
+def _read_csv_frame(
+    file_obj,
+    sep: str,
+    encoding: str,
+    columns: Optional[Set[str]] = None
+) -> pd.DataFrame:
+    """
+    Legge un CSV con il motore C, tutte le colonne come testo.
+
+    Il motore pyarrow non viene usato: con dtype=str prima deduce il tipo
+    delle colonne e solo dopo le converte in testo, perdendo gli zeri
+    iniziali di codici e barcode ("0012345" -> "12345") e trasformando
+    gli interi in float ("3" -> "3.0").
+
+    Args:
+        file_obj: Percorso o buffer del file CSV
+        sep: Separatore CSV
+        encoding: Encoding CSV
+        columns: Colonne da leggere (None = tutte); quelle assenti vengono ignorate
+
+    Returns:
+        DataFrame con tutte le colonne come stringhe
+    """
+    usecols = columns.__contains__ if columns is not None else None
+    return pd.read_csv(file_obj, sep=sep, dtype=str, encoding=encoding, usecols=usecols)
+
+
+def _to_arrow_strings(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converte tutte le colonne in `string[pyarrow]` se pyarrow è disponibile.
+
+    Le stringhe Arrow occupano meno memoria degli oggetti Python e rendono
+    vettoriali isin, str.contains, duplicated e groupby.
+
+    Args:
+        df: DataFrame con colonne testuali
+
+    Returns:
+        DataFrame convertito, o quello originale se pyarrow non è installato
+    """
+    try:
+        return df.astype("string[pyarrow]")
+    except ImportError:
+        return df
+
+
+def read_data_frame(
     file_path: Union[str, Path, io.BytesIO],
     sheet: Optional[str] = None,
     sep: str = ",",
-    encoding: str = "utf-8"
-) -> Tuple[pd.DataFrame, List[Dict[str, str]]]:
+    encoding: str = "utf-8",
+    suffix: Optional[str] = None,
+    columns: Optional[Iterable[str]] = None
+) -> pd.DataFrame:
     """
-    Legge i dati da file Excel o CSV.
+    Legge i dati da file Excel o CSV come DataFrame di stringhe.
 
     Args:
         file_path: Percorso del file o BytesIO object
         sheet: Nome foglio Excel (None = primo foglio)
         sep: Separatore CSV
         encoding: Encoding CSV
+        suffix: Estensione del file per BytesIO (".xlsx", ".xls", ".csv"; None = ".xlsx")
+        columns: Colonne da leggere (None = tutte); quelle assenti nel file vengono ignorate
 
     Returns:
-        Tupla (DataFrame, lista di dizionari con righe)
+        DataFrame con tutte le colonne come stringhe (celle vuote = "")
 
     Raises:
         ValueError: Se formato file non supportato
@@ -77,22 +168,53 @@ def read_excel_data(
         suffix = path.suffix.lower()
         file_obj = path
     elif isinstance(file_path, io.BytesIO):
-        # Per Streamlit file upload, determina tipo dal nome o contenuto
-        # Assume Excel per BytesIO (Streamlit usa questo per upload)
-        suffix = ".xlsx"
+        # Per Streamlit file upload il tipo arriva dal nome del file caricato;
+        # senza indicazione si assume Excel
+        suffix = suffix.lower() if suffix else ".xlsx"
         file_obj = file_path
     else:
         raise ValueError("file_path deve essere str, Path o BytesIO")
 
-    # Leggi dati
+    # Leggi dati (solo le colonne richieste, se indicate)
+    wanted = set(columns) if columns is not None else None
     if suffix in (".xlsx", ".xls"):
         sheet_to_read = sheet if sheet is not None else 0
-        df = pd.read_excel(file_obj, sheet_name=sheet_to_read, dtype=str).fillna("")
+        df = _read_excel_frame(file_obj, sheet_to_read, suffix, wanted).fillna("")
     elif suffix == ".csv":
-        df = pd.read_csv(file_obj, sep=sep, dtype=str, encoding=encoding).fillna("")
+        df = _read_csv_frame(file_obj, sep, encoding, wanted).fillna("")
     else:
         raise ValueError("Formato dati non supportato. Usa .xlsx/.xls o .csv")
 
+    return _to_arrow_strings(df)
+
+
+def read_excel_data(
+    file_path: Union[str, Path, io.BytesIO],
+    sheet: Optional[str] = None,
+    sep: str = ",",
+    encoding: str = "utf-8",
+    suffix: Optional[str] = None,
+    columns: Optional[Iterable[str]] = None
+) -> Tuple[pd.DataFrame, List[Dict[str, str]]]:
+    """
+    Legge i dati da file Excel o CSV, anche come lista di righe.
+
+    Args:
+        file_path: Percorso del file o BytesIO object
+        sheet: Nome foglio Excel (None = primo foglio)
+        sep: Separatore CSV
+        encoding: Encoding CSV
+        suffix: Estensione del file per BytesIO (".xlsx", ".xls", ".csv"; None = ".xlsx")
+        columns: Colonne da leggere (None = tutte); quelle assenti nel file vengono ignorate
+
+    Returns:
+        Tupla (DataFrame, lista di dizionari con righe)
+
+    Raises:
+        ValueError: Se formato file non supportato
+        FileNotFoundError: Se file non esiste (solo per Path)
+    """
+    df = read_data_frame(file_path, sheet, sep, encoding, suffix, columns)
     rows = df.to_dict(orient="records")
     return df, rows
 
@@ -188,7 +310,24 @@ def validate_data(template_xml: str, data_rows: List[Dict[str, str]]) -> Dict[st
             'is_valid': False
         }
 
-    columns = set(data_rows[0].keys())
+    return validate_columns(template_xml, data_rows[0].keys())
+
+
+def validate_columns(template_xml: str, columns: Iterable[str]) -> Dict[str, any]:
+    """
+    Valida i placeholder del template contro i nomi delle colonne dei dati.
+
+    La validazione guarda solo i nomi delle colonne, quindi non servono le righe.
+
+    Args:
+        template_xml: Contenuto XML del template
+        columns: Nomi delle colonne nei dati
+
+    Returns:
+        Dizionario con le stesse chiavi di validate_data
+    """
+    placeholders = extract_placeholders(template_xml)
+    columns = set(columns)
     missing = sorted([p for p in placeholders if p not in columns])
     unused = sorted([c for c in columns if c not in placeholders])
 
@@ -201,6 +340,20 @@ def validate_data(template_xml: str, data_rows: List[Dict[str, str]]) -> Dict[st
     }
 
 
+def _escape_value(value) -> str:
+    """
+    Converte un valore in testo XML-safe per il template.
+
+    I valori delle etichette (codici, taglie, colori) quasi mai contengono
+    caratteri speciali: il controllo con `in` evita le tre replace di
+    xml_escape nel caso comune.
+    """
+    text = "" if value is None else str(value)
+    if "&" in text or "<" in text or ">" in text:
+        return xml_escape(text)
+    return text
+
+
 def fill_template(template_xml: str, data: Dict[str, str]) -> str:
     """
     Riempie il template XML con i dati di una riga.
@@ -210,14 +363,53 @@ def fill_template(template_xml: str, data: Dict[str, str]) -> str:
         data: Dizionario con i dati per questa etichetta
 
     Returns:
-        XML riempito con i dati
+        XML riempito con i dati (i placeholder senza dato restano invariati)
+    """
+    def replace(match: re.Match) -> str:
+        key = match.group(1)
+        if key not in data:
+            return match.group(0)
+        return _escape_value(data[key])
+
+    # Una sola scansione del template, invece di una replace per colonna
+    return PLACEHOLDER_RX.sub(replace, template_xml)
+
+
+def compile_template(template_xml: str) -> List[str]:
     """
-    result = template_xml
-    for key, value in data.items():
-        placeholder = f"{{{{{key}}}}}"
-        safe_value = xml_escape("" if value is None else str(value))
-        result = result.replace(placeholder, safe_value)
-    return result
+    Divide il template nei segmenti di testo e nei nomi dei placeholder.
+
+    Il template viene scansionato una sola volta: le righe vengono poi
+    riempite concatenando i segmenti, senza cercare ogni placeholder nell'XML.
+
+    Args:
+        template_xml: Contenuto XML del template
+
+    Returns:
+        Lista di segmenti: indici pari = testo, indici dispari = nome placeholder
+    """
+    return PLACEHOLDER_RX.split(template_xml)
+
+
+def fill_compiled_template(segments: List[str], data: Dict[str, str]) -> str:
+    """
+    Riempie un template già diviso da compile_template con i dati di una riga.
+
+    Args:
+        segments: Segmenti restituiti da compile_template
+        data: Dizionario con i dati per questa etichetta
+
+    Returns:
+        XML riempito con i dati (i placeholder senza dato restano invariati)
+    """
+    parts = segments.copy()
+    for i in range(1, len(parts), 2):
+        key = parts[i]
+        if key in data:
+            parts[i] = _escape_value(data[key])
+        else:
+            parts[i] = f"{{{{{key}}}}}"
+    return "".join(parts)
 
 
 def sanitize_filename(filename: str) -> str:
@@ -231,8 +423,8 @@ def sanitize_filename(filename: str) -> str:
         Nome file pulito e sicuro
     """
     s = filename.strip().replace("/", "-").replace("\\", "-").replace(":", "-")
-    s = re.sub(r"[^\w\-. ]+", "-", s)
-    s = re.sub(r"\s+", "_", s)
+    s = UNSAFE_FILENAME_RX.sub("-", s)
+    s = WHITESPACE_RX.sub("_", s)
     return s[:180] or "label"
 
 
@@ -259,9 +451,63 @@ def build_filename(pattern: str, row_data: Dict[str, str], row_index: int) -> st
     return sanitize_filename(name)
 
 
+def iter_rows(data_rows: Union[pd.DataFrame, Iterable[Dict[str, str]]]) -> Iterator[Dict[str, str]]:
+    """
+    Itera le righe dati come dizionari, una alla volta.
+
+    Per un DataFrame usa itertuples (molto più veloce di to_dict/iterrows)
+    e costruisce il dizionario della riga solo quando serve, senza
+    materializzare l'intera lista di record.
+
+    Args:
+        data_rows: DataFrame oppure iterabile di dizionari
+
+    Returns:
+        Iteratore di dizionari {colonna: valore}
+    """
+    if isinstance(data_rows, pd.DataFrame):
+        columns = list(data_rows.columns)
+        for values in data_rows.itertuples(index=False, name=None):
+            yield dict(zip(columns, values))
+    else:
+        yield from data_rows
+
+
+def iter_labels(
+    template_xml: str,
+    data_rows: Union[pd.DataFrame, List[Dict[str, str]]],
+    filename_pattern: str = "{Code}_{Color}_{Size}.dymo",
+    limit: Optional[int] = None
+) -> Iterator[Tuple[str, str]]:
+    """
+    Genera le etichette DYMO una alla volta, senza tenerle tutte in memoria.
+
+    Args:
+        template_xml: Contenuto XML del template
+        data_rows: DataFrame o lista di righe dati
+        filename_pattern: Pattern per nome file
+        limit: Numero massimo di etichette da generare (None = tutte)
+
+    Yields:
+        Tuple (filename, xml_content)
+    """
+    if limit:
+        rows_to_process = data_rows.head(limit) if isinstance(data_rows, pd.DataFrame) else data_rows[:limit]
+    else:
+        rows_to_process = data_rows
+
+    # Il template viene diviso in segmenti una volta sola per tutte le righe
+    segments = compile_template(template_xml)
+
+    for idx, row in enumerate(iter_rows(rows_to_process), 1):
+        filled_xml = fill_compiled_template(segments, row)
+        filename = build_filename(filename_pattern, row, idx)
+        yield filename, filled_xml
+
+
 def generate_labels(
     template_xml: str,
-    data_rows: List[Dict[str, str]],
+    data_rows: Union[pd.DataFrame, List[Dict[str, str]]],
     filename_pattern: str = "{Code}_{Color}_{Size}.dymo",
     limit: Optional[int] = None
 ) -> List[Tuple[str, str]]:
@@ -270,37 +516,38 @@ def generate_labels(
 
     Args:
         template_xml: Contenuto XML del template
-        data_rows: Lista di righe dati
+        data_rows: DataFrame o lista di righe dati
         filename_pattern: Pattern per nome file
         limit: Numero massimo di etichette da generare (None = tutte)
 
     Returns:
         Lista di tuple (filename, xml_content)
     """
-    rows_to_process = data_rows[:limit] if limit else data_rows
-    labels = []
+    return list(iter_labels(template_xml, data_rows, filename_pattern, limit))
 
-    for idx, row in enumerate(rows_to_process, 1):
-        filled_xml = fill_template(template_xml, row)
-        filename = build_filename(filename_pattern, row, idx)
-        labels.append((filename, filled_xml))
 
-    return labels
-
-
-def create_zip_archive(labels: List[Tuple[str, str]]) -> io.BytesIO:
+def create_zip_archive(
+    labels: Iterable[Tuple[str, str]],
+    file_obj: Optional[BinaryIO] = None
+) -> BinaryIO:
     """
     Crea un archivio ZIP contenente tutte le etichette generate.
 
+    Le etichette vengono scritte nell'archivio man mano che vengono prodotte,
+    quindi `labels` puo' essere un generatore (vedi iter_labels).
+
     Args:
-        labels: Lista di tuple (filename, xml_content)
+        labels: Iterabile di tuple (filename, xml_content)
+        file_obj: File binario scrivibile di destinazione (None = BytesIO in memoria)
 
     Returns:
-        BytesIO object contenente il file ZIP
+        Il file di destinazione contenente il file ZIP, riposizionato all'inizio
     """
-    zip_buffer = io.BytesIO()
+    zip_buffer = file_obj if file_obj is not None else io.BytesIO()
 
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+    # Livello 1: lo ZIP e' solo un contenitore per il download, il livello di
+    # default (6) spende molta piu' CPU per un guadagno minimo sugli XML
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zip_file:
         for filename, content in labels:
             zip_file.writestr(filename, content)
 